@@ -1,18 +1,28 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import heapq
 import json
 import logging
 import os
 import random
+import re
 import sys
-import time
+from collections import deque
 from dataclasses import dataclass, field
 from datetime import timedelta
-from threading import Event
-from time import sleep
+from time import monotonic
 
 import paho.mqtt.client as mqtt
 
+try:
+    # Optional faster JSON codec, falls back to the standard library
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -67,18 +77,34 @@ MQTT_PORT = args.port
 MQTT_USER = args.user
 MQTT_PASSWORD = args.password
 MAX_CONCURRENT_UPDATES = args.max_concurrent
+SCHEDULER_INTERVAL = 5
+# Max wait for a device to acknowledge an update before starting the next one
+START_ACK_TIMEOUT = 10
+
+# Request payloads are always {"id": <ieee>}; IEEE addresses are plain hex
+# so the JSON can be assembled without an encoder.
+_ID_PREFIX = b'{"id":"'
+_ID_SUFFIX = b'"}'
+
+# Device name quoted in z2m check errors, used when the response has no id
+_ERR_NAME_RE = re.compile(r"(?:already in progress for|available for) '([^']+)'")
 
 # Global State
 otadict = {}
-currently_updating = []
-sent_request = []
-init_done_event = Event()
+name_index = {}
+currently_updating = set()
+sent_request = set()
+init_done_event = asyncio.Event()
+scheduler_event = asyncio.Event()
+pending_updateable = deque()
+watchdog_event = asyncio.Event()
+watchdog_heap = []
 nicer_output_flag = False
 only_once = True
 num_total = 0
 
 
-@dataclass
+@dataclass(slots=True)
 class OtaDevice:
     friendly_name: str
     ieee_addr: str
@@ -89,20 +115,31 @@ class OtaDevice:
     last_progress: float = 0
     retries: int = 0
     failed: bool = False
+    ieee_bytes: bytes = field(init=False, repr=False)
+    topic: str = field(init=False, repr=False)
+    ack_event: asyncio.Event | None = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.ieee_bytes = self.ieee_addr.encode("ascii")
+        self.topic = sys.intern(f"zigbee2mqtt/{self.friendly_name}")
 
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         logger.info("Connected to MQTT broker")
-        client.subscribe("zigbee2mqtt/bridge/devices")
-        client.subscribe("zigbee2mqtt/bridge/response/device/ota_update/check")
-        client.subscribe("zigbee2mqtt/bridge/response/device/ota_update/update")
         # Ensure we're subscribed to all devices we already know about
-        for dev in otadict.values():
-            if dev.updating:
-                topic = f"zigbee2mqtt/{dev.friendly_name}"
-                client.subscribe(topic)
-                logger.info(f"Subscribed to {topic} on reconnect.")
+        device_topics = [dev.topic for dev in otadict.values() if dev.updating]
+        # One SUBSCRIBE packet carrying every topic filter
+        client.subscribe(
+            [
+                ("zigbee2mqtt/bridge/devices", 0),
+                ("zigbee2mqtt/bridge/response/device/ota_update/check", 0),
+                ("zigbee2mqtt/bridge/response/device/ota_update/update", 0),
+            ]
+            + [(topic, 0) for topic in device_topics]
+        )
+        for topic in device_topics:
+            logger.info(f"Subscribed to {topic} on reconnect.")
         # Request device list explicitly
         client.publish("zigbee2mqtt/bridge/request/devices", payload="")
     else:
@@ -110,47 +147,66 @@ def on_connect(client, userdata, flags, rc):
 
 
 def on_message(client, userdata, msg):
-    global nicer_output_flag, only_once, otadict
-    try:
-        message = (msg.payload).decode("utf-8")
-        if not message:
+    if not msg.payload:
+        return
+
+    handler = TOPIC_HANDLERS.get(msg.topic)
+    if handler is None:
+        if not msg.topic.startswith(DEVICE_TOPIC_PREFIX) or msg.topic.startswith(
+            BRIDGE_TOPIC_PREFIX
+        ):
+            return
+        # Most device messages are plain telemetry, skip them before parsing
+        if b'"update"' not in msg.payload:
             return
-        obj = json.loads(message)
-    except (json.JSONDecodeError, UnicodeDecodeError) as e:
-        logger.debug(f"Could not decode message on topic {msg.topic}: {e}")
+
+    obj = decode_payload(msg)
+    if obj is None:
         return
 
-    lower_topic = msg.topic.lower()
-    if lower_topic == "zigbee2mqtt/bridge/devices":
-        if only_once:
-            handle_devicelist(client, obj)
-            only_once = False
-    elif lower_topic == "zigbee2mqtt/bridge/response/device/ota_update/check":
-        if not nicer_output_flag:
-            logger.info("Fetching update responses:")
-            nicer_output_flag = True
-        handle_otacheck(client, obj)
-    elif lower_topic == "zigbee2mqtt/bridge/response/device/ota_update/update":
-        handle_otasuccess(client, obj)
-    elif msg.topic.startswith("zigbee2mqtt/") and "bridge" not in lower_topic:
-        if "update" in obj:
-            logger.debug(f"Received update message for {msg.topic}: {obj['update']}")
-            device_fn = msg.topic.split("/", 1)[1]
-            update_progress(device_fn, obj["update"])
+    if handler:
+        handler(client, obj)
+    elif isinstance(obj, dict) and "update" in obj:
+        logger.debug("Received update message for %s: %s", msg.topic, obj["update"])
+        device_fn = msg.topic[len(DEVICE_TOPIC_PREFIX) :]
+        update_progress(device_fn, obj["update"])
+
+
+def decode_payload(msg):
+    try:
+        # Both codecs accept the raw bytes payload directly
+        return json_loads(msg.payload)
+    except ValueError as e:
+        logger.debug("Could not decode message on topic %s: %s", msg.topic, e)
+        return None
+
+
+def _dispatch_devices(client, obj):
+    global only_once
+    if only_once:
+        handle_devicelist(client, obj)
+        only_once = False
+
+
+def _dispatch_otacheck(client, obj):
+    global nicer_output_flag
+    if not nicer_output_flag:
+        logger.info("Fetching update responses:")
+        nicer_output_flag = True
+    handle_otacheck(client, obj)
 
 
 def update_progress(device_fn, update_data):
+    # Only devices we are tracking an update for are of interest
+    dev = name_index.get(device_fn)
+    if dev is None or not dev.updating:
+        return
+
     if not isinstance(update_data, dict):
         # Handle string or other simple types
-        logger.info(f"Update status for {device_fn}: {update_data}")
+        logger.info("Update status for %s: %s", device_fn, update_data)
         if update_data == "idle":
-            r = [
-                d
-                for d in otadict.values()
-                if d.updating and d.friendly_name == device_fn
-            ]
-            if r:
-                otacleanup(client, r[0])
+            otacleanup(client, dev)
         return
 
     state = update_data.get("state")
@@ -159,48 +215,39 @@ def update_progress(device_fn, update_data):
 
     if progress is not None:
         try:
-            msg = f"Updating {device_fn} - {float(progress):6.2f}%"
             if remaining is not None:
-                remaining_time = timedelta(seconds=int(remaining))
-                msg += f", {remaining_time} remaining"
-            logger.info(msg)
+                logger.info(
+                    "Updating %s - %6.2f%%, %s remaining",
+                    device_fn,
+                    float(progress),
+                    timedelta(seconds=int(remaining)),
+                )
+            else:
+                logger.info("Updating %s - %6.2f%%", device_fn, float(progress))
         except (ValueError, TypeError):
             logger.debug(
-                f"Could not format progress data for {device_fn}: {update_data}"
+                "Could not format progress data for %s: %s", device_fn, update_data
             )
 
         # Update heartbeat
-        res = [
-            d for d in otadict.values() if d.updating and d.friendly_name == device_fn
-        ]
-        if res:
-            res[0].last_progress = time.time()
+        dev.last_progress = monotonic()
+        ack_update(dev)
 
     elif state:
-        logger.info(f"Update status for {device_fn}: {state}")
+        logger.info("Update status for %s: %s", device_fn, state)
 
         if state == "idle":
-            r = [
-                d
-                for d in otadict.values()
-                if d.updating and d.friendly_name == device_fn
-            ]
-            if r:
-                otacleanup(client, r[0])
+            otacleanup(client, dev)
         elif state == "updating":
             # Ensure we have a heartbeat for starting
-            res = [
-                d
-                for d in otadict.values()
-                if d.updating and d.friendly_name == device_fn
-            ]
-            if res:
-                res[0].last_progress = time.time()
+            dev.last_progress = monotonic()
+            ack_update(dev)
 
 
 def handle_devicelist(client, devicelist):
     logger.info("Looking for supported devices:")
-    global otadict, num_total, currently_updating
+    global otadict, name_index, num_total, currently_updating
+    to_check = []
     for device in devicelist:
         if device.get("definition"):
             # Initial detection of update available from raw device data
@@ -210,8 +257,9 @@ def handle_devicelist(client, devicelist):
             )
 
             dev = OtaDevice(
-                friendly_name=device["friendly_name"],
-                ieee_addr=device["ieee_address"],
+                # Interned so lookups and comparisons can short-circuit on identity
+                friendly_name=sys.intern(device["friendly_name"]),
+                ieee_addr=sys.intern(device["ieee_address"]),
                 supports_ota=device["definition"]["supports_ota"],
                 update_available=raw_update_available,
             )
@@ -238,18 +286,19 @@ def handle_devicelist(client, devicelist):
                         dev.updating = True
                         dev.update_available = True
                         already_handled = True
-                        if dev.ieee_addr not in currently_updating:
-                            currently_updating.append(dev.ieee_addr)
+                        currently_updating.add(dev.ieee_addr)
 
-                        topic = f"zigbee2mqtt/{dev.friendly_name}"
-                        client.subscribe(topic)
+                        client.subscribe(dev.topic)
                         logger.info(
-                            f"  {dev.friendly_name} is already updating. Subscribed to {topic}"
+                            f"  {dev.friendly_name} is already updating. Subscribed to {dev.topic}"
                         )
-                        dev.last_progress = time.time()
+                        watch_update(dev)
 
                 otadict[dev.ieee_addr] = dev
+                name_index[dev.friendly_name] = dev
                 num_total += 1
+                if dev.update_available and not dev.updating:
+                    queue_update(dev)
                 if already_handled:
                     logger.debug(
                         f"  {dev.friendly_name} skip initial check, state handled."
@@ -258,7 +307,9 @@ def handle_devicelist(client, devicelist):
                     logger.info(
                         f"  {dev.friendly_name} supports OTA Updates, checking for new updates"
                     )
-                    check_for_update(client, dev)
+                    to_check.append(dev)
+
+    check_for_updates(client, to_check)
 
     if num_total == 0 or not sent_request:
         logger.info("No OTA-supported devices found (or all already checked).")
@@ -268,7 +319,8 @@ def handle_devicelist(client, devicelist):
 
 def handle_otacheck(client, obj):
     global otadict, sent_request, num_total
-    logger.debug(f"Raw check response: {json.dumps(obj)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Raw check response: %s", json.dumps(obj))
 
     # Robust lookup by ID or Friendly Name
     res_id = obj.get("data", {}).get("id")
@@ -276,36 +328,27 @@ def handle_otacheck(client, obj):
     if not res_id and obj.get("status") == "error":
         # Fallback: Extract friendly name from error message if possible
         error_msg = obj.get("error", "")
-        for marker in ["already in progress for '", "available for '"]:
-            if marker in error_msg:
-                try:
-                    res_id = error_msg.split(marker)[1].split("'")[0]
-                    logger.info(f"Extracted device name '{res_id}' from error message.")
-                    break
-                except IndexError:
-                    pass
+        m = _ERR_NAME_RE.search(error_msg)
+        if m:
+            res_id = m.group(1)
+            logger.info("Extracted device name '%s' from error message.", res_id)
 
     if not res_id:
-        logger.warning(f"Check response missing ID in data: {obj}")
+        logger.warning("Check response missing ID in data: %s", obj)
         return
 
-    res = [
-        d
-        for d in otadict.values()
-        if d.friendly_name == res_id or d.ieee_addr == res_id
-    ]
-    if not res:
-        logger.debug(f"Check response for unknown device {res_id}")
+    device = name_index.get(res_id) or otadict.get(res_id)
+    if not device:
+        logger.debug("Check response for unknown device %s", res_id)
         return
 
-    device = res[0]
     ieee = device.ieee_addr
 
-    if ieee in sent_request:
-        sent_request.remove(ieee)
+    sent_request.discard(ieee)
 
     progress = f"[{num_total - len(sent_request)}/{num_total}]"
     if obj.get("status") == "ok":
+        was_available = device.update_available
         raw_val = obj["data"].get("update_available")
         if raw_val is None:
             raw_val = obj["data"].get("updateAvailable")
@@ -320,26 +363,37 @@ def handle_otacheck(client, obj):
             device.update_available = bool(raw_val)
 
         logger.info(
-            f"  {progress} {device.friendly_name} has an update available: {device.update_available}"
+            "  %s %s has an update available: %s",
+            progress,
+            device.friendly_name,
+            device.update_available,
         )
+        # Only queue on a state transition so each device is queued once
+        if device.updating:
+            pass
+        elif device.update_available and not was_available:
+            queue_update(device)
+        elif was_available and not device.update_available:
+            dequeue_update(device)
     else:
         error_msg = obj.get("error", "Unknown error")
-        logger.warning(f"  {progress} {device.friendly_name}: {error_msg}")
+        logger.warning("  %s %s: %s", progress, device.friendly_name, error_msg)
         # If it's already in progress, mark it as available/updating
         if "in progress" in error_msg.lower():
             device.update_available = True
             device.updating = True
-            if device.ieee_addr not in currently_updating:
-                currently_updating.append(device.ieee_addr)
-            topic = f"zigbee2mqtt/{device.friendly_name}"
-            client.subscribe(topic)
-            device.last_progress = time.time()
+            currently_updating.add(device.ieee_addr)
+            client.subscribe(device.topic)
+            watch_update(device)
             logger.info(
-                f"  {device.friendly_name} is already performing an operation. Subscribed to {topic}"
+                "  %s is already performing an operation. Subscribed to %s",
+                device.friendly_name,
+                device.topic,
             )
 
     if not sent_request:
         init_done_event.set()
+        notify_scheduler()
 
 
 def handle_otasuccess(client, obj):
@@ -351,61 +405,128 @@ def handle_otasuccess(client, obj):
             handle_failed_update(client, otadict[ieee])
     else:
         name = obj.get("data", {}).get("id")
-        res = [
-            d
-            for d in otadict.values()
-            if d.friendly_name == name or d.ieee_addr == name
-        ]
-        if res:
-            otacleanup(client, res[0])
+        dev = name_index.get(name) or otadict.get(name)
+        if dev:
+            otacleanup(client, dev)
 
 
 def handle_failed_update(client, dev: OtaDevice):
     global currently_updating
     logger.warning(f"Update failed for {dev.friendly_name}")
     dev.updating = False
-    if dev.ieee_addr in currently_updating:
-        currently_updating.remove(dev.ieee_addr)
+    ack_update(dev)
+    currently_updating.discard(dev.ieee_addr)
 
     if dev.retries < args.retries:
         dev.retries += 1
         logger.info(
             f"Retrying {dev.friendly_name} (Attempt {dev.retries + 1}/{args.retries + 1})"
         )
+        queue_update(dev)
     else:
         logger.error(f"Max retries reached for {dev.friendly_name}. Skipping.")
         dev.failed = True
         dev.update_available = False
+        notify_scheduler()
 
 
-def get_updateable_devices():
-    return [
-        device
-        for device in otadict.values()
-        if device.update_available and not device.updating and not device.failed
-    ]
+def queue_update(dev: OtaDevice):
+    pending_updateable.append(dev)
+    scheduler_event.set()
+
+
+def dequeue_update(dev: OtaDevice):
+    try:
+        pending_updateable.remove(dev)
+    except ValueError:
+        pass
+
+
+def notify_scheduler():
+    scheduler_event.set()
+
+
+def ack_update(dev: OtaDevice):
+    # Releases the scheduler if it is still waiting on this device's start
+    if dev.ack_event:
+        dev.ack_event.set()
+
+
+def watch_update(dev: OtaDevice):
+    dev.last_progress = monotonic()
+    heapq.heappush(watchdog_heap, (dev.last_progress + args.timeout, dev.ieee_addr))
+    watchdog_event.set()
+
+
+async def wait_event(event: asyncio.Event, timeout=None):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def watchdog_loop(client):
+    while True:
+        now = monotonic()
+        if not watchdog_heap or watchdog_heap[0][0] > now:
+            watchdog_event.clear()
+            delay = watchdog_heap[0][0] - now if watchdog_heap else None
+            await wait_event(watchdog_event, delay)
+            continue
+
+        _, ieee = heapq.heappop(watchdog_heap)
+        dev = otadict.get(ieee)
+        if not dev or not dev.updating:
+            continue
+        deadline = dev.last_progress + args.timeout
+        if deadline > now:
+            # Progress arrived since this entry was pushed, re-arm it
+            heapq.heappush(watchdog_heap, (deadline, ieee))
+            continue
+        logger.error(
+            f"Timeout updating {dev.friendly_name} (no progress for {args.timeout}s)"
+        )
+        handle_failed_update(client, dev)
 
 
 def otacleanup(client, dev: OtaDevice):
     global currently_updating
     dev.updating = False
     dev.update_available = False
-    if dev.ieee_addr in currently_updating:
-        currently_updating.remove(dev.ieee_addr)
+    ack_update(dev)
+    currently_updating.discard(dev.ieee_addr)
+    name_index.pop(dev.friendly_name, None)
     logger.info(
-        f"Update for {dev.friendly_name} finished - {len(get_updateable_devices())} more updates to go"
+        "Update for %s finished - %d more updates to go",
+        dev.friendly_name,
+        len(pending_updateable),
     )
-    client.unsubscribe(f"zigbee2mqtt/{dev.friendly_name}")
+    client.unsubscribe(dev.topic)
+    notify_scheduler()
+
 
+def publish_multiple(client, msgs):
+    # Queue a batch of (topic, payload) pairs on the live connection. With the
+    # socket driven by asyncio nothing is written until the next writable
+    # callback, so the whole batch is flushed together.
+    for topic, payload in msgs:
+        client.publish(topic, payload=payload, qos=0)
 
-def check_for_update(client, device: OtaDevice):
+
+def check_for_updates(client, devices):
     global sent_request
-    client.publish(
-        "zigbee2mqtt/bridge/request/device/ota_update/check",
-        payload=json.dumps({"id": device.ieee_addr}),
-    )
-    sent_request.append(device.ieee_addr)
-    device.checked_for_update = True
+    # Encode everything up front so the publishes go out as one burst
+    msgs = [
+        (
+            "zigbee2mqtt/bridge/request/device/ota_update/check",
+            _ID_PREFIX + device.ieee_bytes + _ID_SUFFIX,
+        )
+        for device in devices
+    ]
+    for device in devices:
+        sent_request.add(device.ieee_addr)
+        device.checked_for_update = True
+    publish_multiple(client, msgs)
 
 
 def start_update(client, device: OtaDevice):
@@ -416,20 +537,62 @@ def start_update(client, device: OtaDevice):
         return
 
     logger.info(f"Starting Update for {device.friendly_name}")
-    client.subscribe(f"zigbee2mqtt/{device.friendly_name}")
+    client.subscribe(device.topic)
     client.publish(
         "zigbee2mqtt/bridge/request/device/ota_update/update",
-        payload=json.dumps({"id": device.ieee_addr}),
+        payload=_ID_PREFIX + device.ieee_bytes + _ID_SUFFIX,
     )
     device.updating = True
-    device.last_progress = time.time()
-    currently_updating.append(device.ieee_addr)
+    device.ack_event = asyncio.Event()
+    watch_update(device)
+    currently_updating.add(device.ieee_addr)
 
 
 def on_log(client, userdata, level, buf):
     logger.debug(f"MQTT Log: {buf}")
 
 
+def attach_event_loop(client, loop):
+    # Let asyncio drive the MQTT socket instead of a paho network thread
+    misc_task = None
+
+    async def misc_loop():
+        while client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def on_socket_open(client, userdata, sock):
+        nonlocal misc_task
+        loop.add_reader(sock, client.loop_read)
+        misc_task = loop.create_task(misc_loop())
+
+    def on_socket_close(client, userdata, sock):
+        loop.remove_reader(sock)
+        if misc_task:
+            misc_task.cancel()
+
+    def on_socket_register_write(client, userdata, sock):
+        loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(client, userdata, sock):
+        loop.remove_writer(sock)
+
+    client.on_socket_open = on_socket_open
+    client.on_socket_close = on_socket_close
+    client.on_socket_register_write = on_socket_register_write
+    client.on_socket_unregister_write = on_socket_unregister_write
+
+
+# Exact-match routing for bridge topics; anything else under the device
+# prefix is treated as a device state message.
+DEVICE_TOPIC_PREFIX = "zigbee2mqtt/"
+BRIDGE_TOPIC_PREFIX = "zigbee2mqtt/bridge/"
+TOPIC_HANDLERS = {
+    "zigbee2mqtt/bridge/devices": _dispatch_devices,
+    "zigbee2mqtt/bridge/response/device/ota_update/check": _dispatch_otacheck,
+    "zigbee2mqtt/bridge/response/device/ota_update/update": handle_otasuccess,
+}
+
+
 # Main Execution
 try:
     # Try Paho MQTT v2 API
@@ -451,59 +614,81 @@ client.on_log = on_log
 if args.user and args.password:
     client.username_pw_set(args.user, args.password)
 
-logger.info("Starting initialization")
-try:
-    client.connect(MQTT_HOST, MQTT_PORT, 60)
-except Exception as e:
-    logger.error(f"Could not connect to MQTT broker: {e}")
-    sys.exit(1)
-
-client.loop_start()
 
-if not init_done_event.wait(timeout=60):
-    logger.warning("Initialization timed out. Some devices might not have responded.")
+async def run(client):
+    attach_event_loop(client, asyncio.get_running_loop())
 
-logger.info("Finished initialization")
+    logger.info("Starting initialization")
+    try:
+        client.connect(MQTT_HOST, MQTT_PORT, 60)
+    except Exception as e:
+        logger.error(f"Could not connect to MQTT broker: {e}")
+        sys.exit(1)
 
-try:
-    while True:
-        if not client.is_connected():
-            logger.warning("Lost connection to MQTT broker. Waiting...")
-            sleep(5)
-            continue
+    watchdog = asyncio.create_task(watchdog_loop(client))
+    try:
+        try:
+            await asyncio.wait_for(init_done_event.wait(), 60)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Initialization timed out. Some devices might not have responded."
+            )
 
-        # Watchdog check
-        now = time.time()
-        for ieee in list(currently_updating):
-            dev = otadict.get(ieee)
-            if dev and dev.updating and (now - dev.last_progress > args.timeout):
-                logger.error(
-                    f"Timeout updating {dev.friendly_name} (no progress for {args.timeout}s)"
+        logger.info("Finished initialization")
+
+        while True:
+            if not client.is_connected():
+                logger.warning("Lost connection to MQTT broker. Waiting...")
+                if client.socket() is None:
+                    try:
+                        client.reconnect()
+                    except OSError as e:
+                        logger.debug(f"Reconnect failed: {e}")
+                await asyncio.sleep(5)
+                continue
+
+            scheduler_event.clear()
+
+            if args.shuffle:
+                random.shuffle(pending_updateable)
+
+            # Strictly respect the limit
+            while (
+                pending_updateable and len(currently_updating) < MAX_CONCURRENT_UPDATES
+            ):
+                device = pending_updateable.popleft()
+                # Skip entries that went stale while queued
+                if device.updating or device.failed or not device.update_available:
+                    continue
+                start_update(client, device)
+                if device.updating:
+                    # Let the device settle, but move on as soon as it reports in
+                    await wait_event(device.ack_event, START_ACK_TIMEOUT)
+
+            if (
+                init_done_event.is_set()
+                and not pending_updateable
+                and not currently_updating
+            ):
+                break
+
+            if pending_updateable:
+                logger.debug(
+                    f"Update queue full ({len(currently_updating)}/{MAX_CONCURRENT_UPDATES}). Waiting..."
                 )
-                handle_failed_update(client, dev)
-
-        updateable = get_updateable_devices()
-        if args.shuffle:
-            random.shuffle(updateable)
-
-        if init_done_event.is_set() and not updateable and not currently_updating:
-            break
-
-        # Strictly respect the limit
-        current_count = len(currently_updating)
-        if updateable and current_count < MAX_CONCURRENT_UPDATES:
-            device = updateable.pop(0)
-            start_update(client, device)
-            sleep(10)
-        elif updateable and current_count >= MAX_CONCURRENT_UPDATES:
-            logger.debug(
-                f"Update queue full ({current_count}/{MAX_CONCURRENT_UPDATES}). Waiting..."
-            )
 
-        sleep(1)
+            # Woken by state changes, the timeout only covers connection checks
+            await wait_event(scheduler_event, SCHEDULER_INTERVAL)
+    finally:
+        watchdog.cancel()
+        client.disconnect()
+        # Flush the DISCONNECT packet before the event loop goes away
+        client.loop_write()
 
+
+try:
+    asyncio.run(run(client))
 except KeyboardInterrupt:
     logger.info("Aborted by user")
 
-client.loop_stop()
 logger.info("Finished updating")